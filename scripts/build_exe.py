@@ -8,8 +8,24 @@ import os
 import sys
 import subprocess
 import shutil
+from collections import deque
 from pathlib import Path
 
+# Сколько последних строк вывода PyInstaller показать при ошибке сборки
+BUILD_LOG_TAIL = 200
+
+# Модули, которые сборщику не нужны, но попадают в exe транзитивно.
+# xml.dom исключать нельзя: yandex_music разбирает им ответ с прямой ссылкой на трек
+EXCLUDED_MODULES = [
+    "tkinter",
+    "unittest",
+    "pydoc_data",
+    "email.mime",
+    "_pytest",
+    "numpy",
+    "pandas",
+]
+
 def check_pyinstaller():
     """Проверяет установку PyInstaller"""
     try:
@@ -28,8 +44,10 @@ def install_requirements():
     requirements_file = Path(__file__).parent.parent / "requirements.txt"
     
     try:
+        # --disable-pip-version-check: без лишнего запроса к PyPI о новой версии pip
         subprocess.run([
-            sys.executable, "-m", "pip", "install", "-r", str(requirements_file)
+            sys.executable, "-m", "pip", "install", "--disable-pip-version-check",
+            "-r", str(requirements_file)
         ], check=True)
         print("✅ Зависимости установлены")
         return True
@@ -37,6 +55,19 @@ def install_requirements():
         print(f"❌ Ошибка установки зависимостей: {e}")
         return False
 
+def find_upx_dir():
+    """Ищет UPX в папке scripts/upx или в PATH"""
+    local_upx_dir = Path(__file__).parent / "upx"
+    for name in ("upx.exe", "upx"):
+        if (local_upx_dir / name).is_file():
+            return local_upx_dir
+    
+    upx_path = shutil.which("upx")
+    if upx_path:
+        return Path(upx_path).parent
+    
+    return None
+
 def create_exe():
     """Создает exe файл"""
     print("🔄 Создание exe файла...")
@@ -45,6 +76,7 @@ def create_exe():
     main_script = script_dir / "collect_yandex_music_data.py"
     dist_dir = script_dir / "dist"
     build_dir = script_dir / "build"
+    app_dir = dist_dir / "YandexMusicCollector"
     
     # Очищаем предыдущие сборки
     if dist_dir.exists():
@@ -55,46 +87,75 @@ def create_exe():
     # Параметры для PyInstaller
     pyinstaller_args = [
         "pyinstaller",
-        "--onefile",  # Один exe файл
+        "--onedir",  # Папка с exe: не распаковывается во временную папку при каждом запуске
         "--console",  # Консольное приложение
         "--name", "YandexMusicCollector",  # Имя exe файла
         "--icon", "NONE",  # Без иконки (можно добавить позже)
         "--clean",  # Очистить кэш
         "--noconfirm",  # Не спрашивать подтверждения
-        str(main_script)
     ]
     
+    # Исключаем лишние модули, чтобы уменьшить размер exe
+    for module in EXCLUDED_MODULES:
+        pyinstaller_args += ["--exclude-module", module]
+    
+    # Сжимаем бинарные файлы через UPX, если он установлен
+    upx_dir = find_upx_dir()
+    if upx_dir:
+        print(f"✅ UPX найден: {upx_dir}")
+        pyinstaller_args += ["--upx-dir", str(upx_dir)]
+    else:
+        print("⚠️ UPX не найден, сборка без сжатия (положите upx в scripts/upx/)")
+    
+    pyinstaller_args.append(str(main_script))
+    
     try:
-        # Запускаем PyInstaller
-        result = subprocess.run(pyinstaller_args, cwd=script_dir, check=True, 
-                              capture_output=True, text=True)
+        # Запускаем PyInstaller, выводя его лог по мере сборки
+        process = subprocess.Popen(pyinstaller_args, cwd=script_dir, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT, bufsize=1, text=True)
+        
+        # Храним только хвост лога для сообщения об ошибке
+        last_lines = deque(maxlen=BUILD_LOG_TAIL)
+        for line in process.stdout:
+            print(line, end='')
+            last_lines.append(line)
+        
+        if process.wait() != 0:
+            print(f"❌ Ошибка создания exe: PyInstaller завершился с кодом {process.returncode}")
+            print("Последние строки лога:")
+            print(''.join(last_lines), end='')
+            return False
         
         print("✅ exe файл создан успешно!")
         
         # Проверяем результат
-        exe_file = dist_dir / "YandexMusicCollector.exe"
+        exe_file = app_dir / "YandexMusicCollector.exe"
         if exe_file.exists():
-            file_size = exe_file.stat().st_size / (1024 * 1024)  # MB
-            print(f"📁 Файл: {exe_file}")
-            print(f"📊 Размер: {file_size:.1f} MB")
-            
-            # Создаем README для пользователей
-            create_readme(dist_dir)
+            try:
+                app_size = sum(f.stat().st_size for f in app_dir.rglob("*") if f.is_file())
+                print(f"📁 Файл: {exe_file}")
+                print(f"📊 Размер папки: {app_size / (1024 * 1024):.1f} MB")
+                
+                # Создаем README для пользователей
+                create_readme(app_dir)
+                
+                # Упаковываем папку в zip для распространения
+                archive = shutil.make_archive(str(app_dir), "zip", root_dir=app_dir.parent, base_dir=app_dir.name)
+                print(f"📦 Архив для распространения: {archive}")
+            except OSError as e:
+                print(f"❌ Ошибка упаковки сборки: {e}")
+                return False
             
             return True
         else:
             print("❌ exe файл не найден после сборки")
             return False
             
-    except subprocess.CalledProcessError as e:
-        print(f"❌ Ошибка создания exe: {e}")
-        if e.stdout:
-            print("STDOUT:", e.stdout)
-        if e.stderr:
-            print("STDERR:", e.stderr)
+    except OSError as e:
+        print(f"❌ Ошибка запуска PyInstaller: {e}")
         return False
 
-def create_readme(dist_dir: Path):
+def create_readme(app_dir: Path):
     """Создает README файл для пользователей"""
     readme_content = """# Yandex Music Collector
 
@@ -103,6 +164,8 @@ def create_readme(dist_dir: Path):
 ## Как использовать:
 
 1. **Запустите программу**: Дважды кликните на `YandexMusicCollector.exe`
+   - Не перемещайте exe отдельно от остальных файлов папки - они нужны для запуска
+   - Для передачи программы используйте архив `YandexMusicCollector.zip` или папку целиком
 
 2. **Получите токен**:
    - Откройте music.yandex.ru в браузере
@@ -145,7 +208,7 @@ def create_readme(dist_dir: Path):
 Music Galaxy 3D - Визуализация вашей музыкальной души
 """
     
-    readme_file = dist_dir / "README.txt"
+    readme_file = app_dir / "README.txt"
     with open(readme_file, 'w', encoding='utf-8') as f:
         f.write(readme_content)
     
@@ -177,8 +240,8 @@ def main():
     # Создаем exe
     if create_exe():
         print("\n🎉 Готово!")
-        print("📁 exe файл создан в папке scripts/dist/")
-        print("💡 Теперь можно распространять YandexMusicCollector.exe")
+        print("📁 Программа создана в папке scripts/dist/YandexMusicCollector/")
+        print("💡 Теперь можно распространять архив scripts/dist/YandexMusicCollector.zip")
     else:
         print("\n❌ Не удалось создать exe файл")
         sys.exit(1)
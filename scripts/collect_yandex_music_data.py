@@ -5,16 +5,395 @@
 Создает структуру папок для Music Galaxy 3D
 """
 
+import argparse
 import json
+import logging
 import os
 import sys
 import datetime
-import requests
+import random
+import shutil
+import sqlite3
 import time
+import threading
+from collections import Counter
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import List, Dict, Any, Optional
-from yandex_music import Client
-from yandex_music.exceptions import YandexMusicError
+from importlib.util import find_spec
+from typing import TYPE_CHECKING, List, Dict, Any, Optional, Callable, Tuple
+
+# yandex_music и requests импортируются только там, где нужны: вместе с зависимостями
+# они загружаются заметное время, а приглашение ввести токен должно появляться сразу
+if TYPE_CHECKING:
+    import requests
+    from yandex_music import Client
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен: без него используется стандартный json
+    orjson = None
+
+
+# Сохраненный токен и временный токен, который передает Electron-приложение
+TOKEN_FILE = Path(__file__).parent / '.yandex_token'
+TEMP_TOKEN_FILE = Path(__file__).parent / '.temp_token'
+
+# Количество потоков для получения ссылок и скачивания треков
+MAX_WORKERS = 32
+
+# Максимальное количество одновременных запросов к API Яндекс.Музыки
+# (скачивание аудио с CDN этим лимитом не ограничивается)
+MAX_API_REQUESTS = 8
+
+# Максимальное количество треков в одном запросе client.tracks
+TRACKS_BATCH_SIZE = 100
+
+# Файл кэша метаданных треков в папке коллекции и срок его действия
+CACHE_FILENAME = ".tracks_cache.sqlite"
+CACHE_TTL = datetime.timedelta(days=7)
+
+# Ограничение частоты запросов к API (запросов в секунду). При ответе 429 частота
+# снижается вдвое (не ниже MIN_API_RATE) и затем восстанавливается на
+# API_RATE_RECOVERY за каждый успешный запрос
+API_RATE_LIMIT = 20
+MIN_API_RATE = 1
+API_RATE_RECOVERY = 0.5
+
+# Количество попыток запроса при ответе 429 (Too Many Requests)
+# и максимальная пауза между ними в секундах
+RATE_LIMIT_RETRIES = 5
+MAX_BACKOFF_DELAY = 60
+
+# Размер блока при скачивании аудиофайлов (1 МиБ)
+CHUNK_SIZE = 1 << 20
+
+# Аудиофайлы меньше этого размера (в байтах) считаются недокачанными
+MIN_AUDIO_SIZE = 1024
+
+# Сообщения о ходе сбора; подробности по каждому треку выводятся с флагом --verbose
+logger = logging.getLogger(__name__)
+
+# Слоты для запросов к API, общие для всех потоков
+_api_slots = threading.BoundedSemaphore(MAX_API_REQUESTS)
+
+# Уже определенные жанры исполнителей и альбомов по их id:
+# в коллекции обычно много треков одного исполнителя или альбома
+_artist_genres: Dict[Any, Optional[str]] = {}
+_album_genres: Dict[Any, Optional[str]] = {}
+
+# Таблица замены недопустимых в именах файлов символов на '_'
+_INVALID_FILENAME_CHARS = str.maketrans(dict.fromkeys('<>:"/\\|?*', '_'))
+
+
+def chunks(items: List[Any], size: int):
+    """Разбивает список на части заданного размера"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def dump_json(obj: Any, indent: bool = False) -> bytes:
+    """Сериализует объект в JSON (UTF-8), используя orjson, если он установлен"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None).encode('utf-8')
+
+
+def load_json(data: Any) -> Any:
+    """Разбирает JSON из bytes или str, используя orjson, если он установлен"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class RateLimiter:
+    """Token bucket: ограничивает частоту запросов, допуская короткие всплески.
+    
+    Частота подстраивается под сервер: снижается при ответах 429
+    и постепенно возвращается к исходной при успешных запросах.
+    """
+    
+    def __init__(self, rate: float, capacity: Optional[float] = None, min_rate: float = MIN_API_RATE):
+        self.rate = rate
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        # Когда частота снижалась в последний раз
+        self._slowed_at = float('-inf')
+        self._lock = threading.Lock()
+    
+    def acquire(self) -> None:
+        """Ждет, пока не накопится токен на один запрос"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                
+                wait = (1 - self._tokens) / self.rate
+            
+            time.sleep(wait)
+    
+    def slow_down(self, sent_at: float) -> None:
+        """Вдвое снижает частоту после ответа 429 и сбрасывает накопленный запас.
+        
+        sent_at - время отправки запроса (time.monotonic). Ответы 429 на запросы,
+        отправленные до предыдущего снижения, относятся к той же волне ограничений
+        и частоту повторно не снижают.
+        """
+        with self._lock:
+            if sent_at < self._slowed_at:
+                return
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = 0
+            self._slowed_at = time.monotonic()
+    
+    def speed_up(self) -> None:
+        """Понемногу возвращает частоту к исходной после успешного запроса"""
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + API_RATE_RECOVERY)
+
+
+# Общий лимит частоты запросов к API для всех потоков
+_api_limiter = RateLimiter(API_RATE_LIMIT)
+
+
+def is_rate_limited(error: Exception) -> bool:
+    """Проверяет, что API ответило 429 (слишком много запросов)"""
+    from yandex_music.exceptions import NetworkError
+    
+    return isinstance(error, NetworkError) and '(429)' in str(error)
+
+
+def call_with_backoff(func: Callable, *args, **kwargs):
+    """Выполняет запрос к API с учетом лимита частоты, повторяя его при ответе 429"""
+    from yandex_music.exceptions import NetworkError
+    
+    for attempt in range(RATE_LIMIT_RETRIES):
+        _api_limiter.acquire()
+        try:
+            with _api_slots:
+                sent_at = time.monotonic()
+                result = func(*args, **kwargs)
+        except NetworkError as e:
+            if not is_rate_limited(e):
+                raise
+            _api_limiter.slow_down(sent_at)
+            if attempt == RATE_LIMIT_RETRIES - 1:
+                raise
+            # Экспоненциальная пауза со случайной добавкой, чтобы потоки не повторяли запросы одновременно
+            delay = min(MAX_BACKOFF_DELAY, 2 ** attempt) + random.random()
+            logger.warning(f"  ⏳ Превышен лимит запросов, повтор через {delay:.1f} с")
+            time.sleep(delay)
+        else:
+            _api_limiter.speed_up()
+            return result
+
+
+def create_session() -> 'requests.Session':
+    """Создает requests.Session с пулом соединений на все рабочие потоки"""
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    
+    # Повторы запросов при временных ошибках сервера (429 обрабатывает call_with_backoff)
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504])
+    
+    session = requests.Session()
+    # Размер пула не меньше числа потоков, иначе потоки ждут свободного соединения;
+    # пулы хранятся для нескольких хостов: API и серверов хранилища с аудио
+    adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+@lru_cache(maxsize=None)
+def get_session() -> 'requests.Session':
+    """Возвращает общую сессию для запросов к API и скачивания треков"""
+    return create_session()
+
+
+def create_client(token: str) -> 'Client':
+    """Создает клиент Яндекс.Музыки, все запросы которого идут через общий пул соединений"""
+    import requests
+    from yandex_music import Client
+    from yandex_music.exceptions import NetworkError, TimedOutError
+    from yandex_music.utils.request import Request
+    try:
+        from yandex_music.utils.schema_mismatch import set_current_endpoint
+    except ImportError:  # модуля нет в старых версиях yandex_music
+        set_current_endpoint = None
+    
+    class PooledRequest(Request):
+        """Request из yandex_music, переиспользующий TCP/TLS соединения через общий requests.Session"""
+        
+        def __init__(self, session: requests.Session, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.session = session
+        
+        def _request_wrapper(self, *args, **kwargs) -> bytes:
+            # В старых версиях yandex_music этих методов нет - запрос выполняется без пула соединений
+            if not hasattr(self, '_prepare_kwargs') or not hasattr(self, '_handle_error_response'):
+                return super()._request_wrapper(*args, **kwargs)
+            
+            # Как и в исходном Request: предупреждения о несовпадении схемы ответа с моделями
+            # библиотеки указывают endpoint запроса
+            if set_current_endpoint is not None:
+                set_current_endpoint(*args[:2])
+            kwargs = self._prepare_kwargs(kwargs)
+            try:
+                response = self.session.request(*args, **kwargs)
+            except requests.Timeout as e:
+                raise TimedOutError from e
+            except requests.RequestException as e:
+                raise NetworkError(e) from e
+            
+            if not 200 <= response.status_code < 300:
+                self._handle_error_response(response.status_code, response.content)
+            
+            return response.content
+    
+    return Client(token, request=PooledRequest(get_session())).init()
+
+
+class JsonTracksWriter:
+    """Потоковая запись metadata.json: треки дописываются в файл по мере обработки.
+    
+    Запись идет в metadata.json.part, который заменяет metadata.json только
+    при успешном завершении: прерванный запуск не портит прошлую коллекцию.
+    """
+    
+    def __init__(self, output_file: str, metadata: Dict[str, Any]):
+        self.output_file = output_file
+        self.part_file = output_file + '.part'
+        self.metadata = metadata
+        self.count = 0
+        self.available_count = 0
+        # Статистика по жанрам считается при записи, без второго прохода по трекам
+        self.genres = Counter()
+        self._file = None
+        self._lock = threading.Lock()
+    
+    def __enter__(self) -> 'JsonTracksWriter':
+        self._file = open(self.part_file, 'wb')
+        self._file.write(b'{\n  "tracks": [')
+        return self
+    
+    def write(self, track_data: Dict[str, Any]) -> None:
+        """Дописывает один трек в файл (компактно, без отступов)"""
+        line = dump_json(track_data)
+        with self._lock:
+            self._file.write(b',\n    ' if self.count else b'\n    ')
+            self._file.write(line)
+            self.count += 1
+            self.genres[track_data.get('genre', 'unknown')] += 1
+            if track_data.get('available', False):
+                self.available_count += 1
+            # Сбрасываем на диск сразу: при аварийном завершении записанные треки
+            # останутся в .part для докачки при следующем запуске
+            self._file.flush()
+    
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        # При ошибке или прерывании .part остается как есть, metadata.json не трогаем
+        if exc_type is not None:
+            self._file.close()
+            return
+        
+        # Секция metadata пишется последней: количество треков известно только в конце
+        metadata = {"total_tracks": self.count, **self.metadata}
+        envelope = dump_json(metadata, indent=True).replace(b'\n', b'\n  ')
+        self._file.write(b'\n  ],\n  "metadata": ' + envelope + b'\n}\n')
+        self._file.close()
+        os.replace(self.part_file, self.output_file)
+
+
+def load_written_tracks(metadata_file: str) -> Dict[str, Dict[str, Any]]:
+    """Читает треки, записанные прошлыми запусками.
+    
+    Сначала берется metadata.json.part, оставшийся от прерванного запуска, затем
+    недостающие треки - из metadata.json последнего успешного запуска.
+    JsonTracksWriter пишет каждый трек отдельной строкой, поэтому треки читаются
+    построчно и без закрывающей части файла. В прерванном запуске на диск попадают
+    только треки, записанные по порядку лайков: готовые раньше своей очереди
+    остаются в буфере и теряются, но их mp3 при докачке не скачиваются повторно.
+    """
+    tracks = {}
+    for path in (metadata_file, metadata_file + '.part'):
+        try:
+            with open(path, 'rb') as f:
+                for line in f:
+                    line = line.strip().rstrip(b',')
+                    if not line.startswith(b'{') or line == b'{':
+                        continue
+                    try:
+                        track_data = load_json(line)
+                    except ValueError:
+                        continue  # строка, оборванная при аварийном завершении
+                    if not isinstance(track_data, dict) or 'id' not in track_data:
+                        continue  # файл записан не JsonTracksWriter (например, одной строкой)
+                    # Треки из .part читаются последними и заменяют треки из metadata.json
+                    tracks[str(track_data['id'])] = track_data
+        except OSError:
+            pass
+    return tracks
+
+
+def is_downloaded(audio_path: Path) -> bool:
+    """Проверяет, что аудиофайл уже скачан полностью"""
+    try:
+        return audio_path.stat().st_size >= MIN_AUDIO_SIZE
+    except OSError:
+        return False
+
+
+class TrackCache:
+    """Кэш метаданных треков в SQLite: повторный запуск не запрашивает их у API заново.
+    
+    Ссылки на скачивание не кэшируются - они быстро устаревают.
+    """
+    
+    def __init__(self, cache_file: str, ttl: datetime.timedelta = CACHE_TTL):
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self._conn = None
+        self._lock = threading.Lock()
+    
+    def __enter__(self) -> 'TrackCache':
+        self._conn = sqlite3.connect(self.cache_file, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS tracks(id TEXT PRIMARY KEY, data TEXT, ts INTEGER)")
+        return self
+    
+    def get(self, track_id: str) -> Optional[Dict[str, Any]]:
+        """Возвращает данные трека, если они есть в кэше и не устарели"""
+        min_ts = int(time.time() - self.ttl.total_seconds())
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM tracks WHERE id = ? AND ts > ?", (track_id, min_ts)
+            ).fetchone()
+        return load_json(row[0]) if row else None
+    
+    def put(self, track_data: Dict[str, Any]) -> None:
+        """Сохраняет данные трека в кэш"""
+        data = dump_json(track_data).decode('utf-8')
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tracks (id, data, ts) VALUES (?, ?, ?)",
+                (track_data["id"], data, int(time.time()))
+            )
+            self._conn.commit()
+    
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self._conn.close()
 
 
 def get_token_from_user() -> str:
@@ -59,18 +438,14 @@ def load_saved_token() -> Optional[str]:
     """Загружает сохраненный токен"""
     try:
         # Сначала проверяем временный файл от Electron
-        temp_token_file = os.path.join(os.path.dirname(__file__), '.temp_token')
-        if os.path.exists(temp_token_file):
-            with open(temp_token_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+        if TEMP_TOKEN_FILE.is_file():
+            data = load_json(TEMP_TOKEN_FILE.read_bytes())
             return data['token']
         
         # Затем проверяем обычный сохраненный токен
-        token_file = os.path.join(os.path.dirname(__file__), '.yandex_token')
-        if os.path.exists(token_file):
-            with open(token_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                
+        if TOKEN_FILE.is_file():
+            data = load_json(TOKEN_FILE.read_bytes())
+            
             # Проверяем возраст токена
             created_at = datetime.datetime.fromisoformat(data['created_at'])
             age_hours = (datetime.datetime.now() - created_at).total_seconds() / 3600
@@ -87,14 +462,12 @@ def load_saved_token() -> Optional[str]:
 def save_token(token: str) -> None:
     """Сохраняет токен для будущего использования"""
     try:
-        token_file = os.path.join(os.path.dirname(__file__), '.yandex_token')
         data = {
             'token': token,
-            'created_at': datetime.datetime.now().isoformat()
+            'created_at': datetime.datetime.now().isoformat(timespec='seconds')
         }
         
-        with open(token_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        TOKEN_FILE.write_bytes(dump_json(data, indent=True))
         
         print("💾 Токен сохранен для будущего использования")
     except Exception as e:
@@ -112,49 +485,91 @@ def format_token_for_display(token: str) -> str:
     return f"{start}{middle}{end}"
 
 
+def get_artist_genre(artist) -> Optional[str]:
+    """Возвращает жанр исполнителя, запоминая его по id исполнителя"""
+    artist_id = getattr(artist, 'id', None)
+    if artist_id in _artist_genres:
+        return _artist_genres[artist_id]
+    
+    genres = getattr(artist, 'genres', None)
+    genre = genres[0] if genres else None
+    # Без id разные исполнители попали бы в одну запись
+    if artist_id is not None:
+        _artist_genres[artist_id] = genre
+    return genre
+
+
+def get_album_genre(album) -> Optional[str]:
+    """Возвращает жанр альбома, запоминая его по id альбома"""
+    album_id = getattr(album, 'id', None)
+    if album_id in _album_genres:
+        return _album_genres[album_id]
+    
+    genre = getattr(album, 'genre', None) or None
+    # Без id разные альбомы попали бы в одну запись
+    if album_id is not None:
+        _album_genres[album_id] = genre
+    return genre
+
+
 def extract_genre(track) -> str:
     """Извлекает жанр из данных трека"""
     try:
         # Пробуем получить жанр из исполнителя
-        if track.artists and len(track.artists) > 0:
-            artist = track.artists[0]
-            if hasattr(artist, 'genres') and artist.genres:
-                return artist.genres[0]
+        artists = track.artists
+        if artists:
+            genre = get_artist_genre(artists[0])
+            if genre:
+                return genre
         
         # Пробуем получить жанр из альбома
-        if track.albums and len(track.albums) > 0:
-            album = track.albums[0]
-            if hasattr(album, 'genre') and album.genre:
-                return album.genre
+        albums = track.albums
+        if albums:
+            genre = get_album_genre(albums[0])
+            if genre:
+                return genre
         
         return "unknown"
     except Exception:
         return "unknown"
 
 
+@lru_cache(maxsize=4096)
+def build_cover_url(cover_uri: str) -> str:
+    """Строит URL обложки из cover_uri (одна обложка альбома общая для многих треков)"""
+    # Заменяем %% на размер изображения (placeholder встречается один раз)
+    i = cover_uri.find('%%')
+    if i == -1:
+        return f"https://{cover_uri}"
+    return f"https://{cover_uri[:i]}400x400{cover_uri[i + 2:]}"
+
+
 def get_cover_url(track) -> Optional[str]:
     """Получает URL обложки трека"""
     try:
-        if track.cover_uri:
-            # Заменяем %% на размер изображения
-            return f"https://{track.cover_uri.replace('%%', '400x400')}"
+        cover_uri = track.cover_uri
+        if cover_uri:
+            return build_cover_url(cover_uri)
         
         # Пробуем получить обложку из альбома
-        if track.albums and len(track.albums) > 0:
-            album = track.albums[0]
-            if hasattr(album, 'cover_uri') and album.cover_uri:
-                return f"https://{album.cover_uri.replace('%%', '400x400')}"
+        albums = track.albums
+        if albums:
+            cover_uri = getattr(albums[0], 'cover_uri', None)
+            if cover_uri:
+                return build_cover_url(cover_uri)
         
         return None
     except Exception:
         return None
 
 
-def get_download_url(client: Client, track) -> Optional[str]:
+def get_download_url(client: 'Client', track_id: str, title: str) -> Optional[str]:
     """Получает URL для скачивания полного трека в высоком качестве"""
+    from yandex_music.exceptions import YandexMusicError
+    
     try:
         # Запрашиваем информацию о загрузке
-        download_info_list = track.get_download_info(get_direct_links=True)
+        download_info_list = call_with_backoff(client.tracks_download_info, track_id, get_direct_links=True)
         
         # Ищем лучшее качество MP3
         best_quality = None
@@ -164,74 +579,112 @@ def get_download_url(client: Client, track) -> Optional[str]:
                     best_quality = info
         
         if best_quality:
-            print(f"  ✅ Ссылка для скачивания найдена: '{track.title}' ({best_quality.bitrate_in_kbps}kbps)")
+            logger.debug(f"  ✅ Ссылка для скачивания найдена: '{title}' ({best_quality.bitrate_in_kbps}kbps)")
             return best_quality.direct_link
         
-        print(f"  ⚠️ Ссылка для скачивания недоступна: '{track.title}'")
+        logger.warning(f"  ⚠️ Ссылка для скачивания недоступна: '{title}'")
         return None
         
     except YandexMusicError as e:
-        print(f"  ❌ Ошибка API при получении ссылки для '{track.title}': {e}")
+        logger.error(f"  ❌ Ошибка API при получении ссылки для '{title}': {e}")
         return None
     except Exception as e:
-        print(f"  ❌ Непредвиденная ошибка при получении ссылки для '{track.title}': {e}")
+        logger.error(f"  ❌ Непредвиденная ошибка при получении ссылки для '{title}': {e}")
         return None
 
 
 def sanitize_filename(filename: str) -> str:
     """Очищает имя файла от недопустимых символов"""
-    # Заменяем недопустимые символы
-    invalid_chars = '<>:"/\\|?*'
-    for char in invalid_chars:
-        filename = filename.replace(char, '_')
-    
-    # Убираем лишние пробелы и точки
-    filename = filename.strip('. ')
-    
-    # Ограничиваем длину
-    if len(filename) > 100:
-        filename = filename[:100]
-    
-    return filename
+    # Заменяем недопустимые символы, убираем лишние пробелы и точки, ограничиваем длину
+    return filename.translate(_INVALID_FILENAME_CHARS).strip('. ')[:100]
+
+
+def parse_content_range(header: str) -> tuple[Optional[int], Optional[int]]:
+    """Возвращает начало диапазона и полный размер файла из заголовка Content-Range"""
+    # Формат: "bytes 1000-4999/5000", полный размер может быть неизвестен: "bytes 1000-4999/*"
+    try:
+        span, _, total = header.partition(' ')[2].partition('/')
+        return int(span.split('-', 1)[0]), int(total) if total != '*' else None
+    except ValueError:
+        return None, None
 
 
-def download_track(url: str, output_path: str, track_title: str) -> bool:
-    """Скачивает трек по URL"""
+def download_track(url: str, output_path: Path, track_title: str) -> bool:
+    """Скачивает трек по URL, докачивая файл, оставшийся от прерванной загрузки.
+    
+    Папка для файла создается в create_output_structure.
+    """
+    import requests
+    
     try:
-        print(f"  🔄 Скачивание: {track_title}")
+        logger.debug(f"  🔄 Скачивание: {track_title}")
         
-        # Создаем директорию если не существует
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        # Скачиваем во временный файл: прерванная загрузка не оставляет битый mp3
+        # под итоговым именем, а при следующем запуске докачивается с места обрыва
+        part_path = output_path.with_name(output_path.name + '.part')
+        offset = part_path.stat().st_size if part_path.is_file() else 0
         
-        # Скачиваем файл
-        response = requests.get(url, stream=True, timeout=30)
+        session = get_session()
+        if offset:
+            # Для докачки нужны байты файла как есть, без сжатия при передаче
+            headers = {'Range': f'bytes={offset}-', 'Accept-Encoding': 'identity'}
+            response = session.get(url, headers=headers, stream=True, timeout=30)
+            if response.status_code == 416:
+                # Запрошенный диапазон вне файла: недокачанная часть не подходит, качаем заново
+                response.close()
+                offset = 0
+                response = session.get(url, stream=True, timeout=30)
+        else:
+            response = session.get(url, stream=True, timeout=30)
         response.raise_for_status()
         
-        # Сохраняем файл
-        with open(output_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
+        if response.status_code == 206:
+            start, expected_size = parse_content_range(response.headers.get('Content-Range', ''))
+            if start != offset:
+                logger.warning(f"  ⚠️ Сервер вернул не тот диапазон для {track_title}, файл будет скачан заново")
+                response.close()
+                part_path.unlink()
+                return False
+            logger.debug(f"  ⏯️  Докачка {track_title} с {offset // 1024} KB")
+            mode = 'ab'
+        else:
+            # Сервер не поддерживает диапазоны (или докачка не нужна) - пишем файл с начала
+            mode = 'wb'
+            # Ожидаемый размер известен, только если ответ не сжат при передаче
+            expected_size = None
+            if 'Content-Encoding' not in response.headers:
+                expected_size = int(response.headers.get('Content-Length', 0)) or None
+        
+        # Сохраняем файл, копируя поток ответа напрямую в файл
+        response.raw.decode_content = True
+        # Буфер записи размером с блок: короткие чтения из сети объединяются в крупные записи
+        with open(part_path, mode, buffering=CHUNK_SIZE) as f:
+            shutil.copyfileobj(response.raw, f, CHUNK_SIZE)
         
         # Проверяем размер файла
-        file_size = os.path.getsize(output_path)
-        if file_size < 1024:  # Меньше 1KB - подозрительно
-            print(f"  ⚠️ Подозрительно маленький файл: {file_size} байт")
-            os.remove(output_path)
+        file_size = part_path.stat().st_size
+        if expected_size is not None and file_size != expected_size:
+            logger.warning(f"  ⚠️ Файл скачан не полностью: {file_size} из {expected_size} байт")
+            return False
+        # Меньше 1KB - подозрительно; тот же порог использует is_downloaded
+        if file_size < MIN_AUDIO_SIZE:
+            logger.warning(f"  ⚠️ Подозрительно маленький файл: {file_size} байт")
+            part_path.unlink()
             return False
         
-        print(f"  ✅ Скачано: {track_title} ({file_size // 1024} KB)")
+        part_path.replace(output_path)
+        logger.debug(f"  ✅ Скачано: {track_title} ({file_size // 1024} KB)")
         return True
         
     except requests.exceptions.RequestException as e:
-        print(f"  ❌ Ошибка скачивания {track_title}: {e}")
+        logger.error(f"  ❌ Ошибка скачивания {track_title}: {e}")
         return False
     except Exception as e:
-        print(f"  ❌ Непредвиденная ошибка при скачивании {track_title}: {e}")
+        logger.error(f"  ❌ Непредвиденная ошибка при скачивании {track_title}: {e}")
         return False
 
 
-def create_output_structure(output_dir: str) -> tuple[str, str]:
+def create_output_structure(output_dir: str) -> tuple[str, Path]:
     """Создает структуру папок для Music Galaxy 3D"""
     # Создаем основную папку
     output_path = Path(output_dir)
@@ -248,151 +701,284 @@ def create_output_structure(output_dir: str) -> tuple[str, str]:
     print(f"  📂 {audio_path}")
     print(f"  📄 {metadata_file}")
     
-    return str(metadata_file), str(audio_path)
+    return str(metadata_file), audio_path
 
 
-def process_track(client: Client, track, audio_dir: str, download_audio: bool = True) -> Dict[str, Any]:
-    """Обрабатывает один трек и возвращает данные для JSON"""
+def extract_track_data(track) -> Dict[str, Any]:
+    """Извлекает из трека данные для JSON"""
+    artists = track.artists
+    albums = track.albums
+    duration_ms = track.duration_ms
+    
+    return {
+        "id": str(track.id),
+        "title": track.title,
+        "artist": artists[0].name if artists else "Unknown Artist",
+        "album": albums[0].title if albums else "Unknown Album",
+        "duration": duration_ms // 1000 if duration_ms else 0,
+        "genre": extract_genre(track),
+        "cover_url": get_cover_url(track),
+        "available": getattr(track, 'available', True)
+    }
+
+
+def process_track(client: 'Client', track_data: Dict[str, Any], audio_dir: Path,
+                  download_audio: bool = True) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """Обрабатывает один трек (скачивает аудио).
+    
+    Возвращает данные для JSON и признак того, что аудиофайл был скачан сейчас,
+    а не найден на диске с прошлого запуска.
+    """
     try:
-        # Основная информация
-        track_data = {
-            "id": str(track.id),
-            "title": track.title,
-            "artist": track.artists[0].name if track.artists else "Unknown Artist",
-            "album": track.albums[0].title if track.albums else "Unknown Album",
-            "duration": track.duration_ms // 1000 if track.duration_ms else 0,
-            "genre": extract_genre(track),
-            "cover_url": get_cover_url(track),
-            "available": track.available if hasattr(track, 'available') else True
-        }
-        
         # Скачиваем аудиофайл если нужно
         if download_audio and track_data["available"]:
-            download_url = get_download_url(client, track)
+            # Создаем имя файла
+            audio_path = audio_dir / f"{track_data['id']}.mp3"
+            
+            # Уже скачанный файл не запрашиваем повторно
+            if is_downloaded(audio_path):
+                logger.debug(f"  ⏭️  Уже скачан: {track_data['title']}")
+                return track_data, False
+            
+            download_url = get_download_url(client, track_data['id'], track_data['title'])
             if download_url:
-                # Создаем имя файла
-                audio_filename = f"{track_data['id']}.mp3"
-                audio_path = os.path.join(audio_dir, audio_filename)
-                
                 # Скачиваем трек
                 if download_track(download_url, audio_path, track_data['title']):
-                    print(f"  ✅ Трек скачан: {track.title}")
+                    logger.debug(f"  ✅ Трек скачан: {track_data['title']}")
+                    return track_data, True
                 else:
-                    print(f"  ⚠️ Не удалось скачать: {track.title}")
+                    logger.warning(f"  ⚠️ Не удалось скачать: {track_data['title']}")
                     track_data["available"] = False
             else:
-                print(f"  ⚠️ Ссылка недоступна: {track.title}")
+                logger.warning(f"  ⚠️ Ссылка недоступна: {track_data['title']}")
                 track_data["available"] = False
         
-        return track_data
+        return track_data, False
     
     except Exception as e:
-        print(f"❌ Ошибка обработки трека: {e}")
-        return None
+        logger.error(f"❌ Ошибка обработки трека: {e}")
+        return None, False
 
 
-def collect_liked_tracks(token: str, output_dir: str, download_audio: bool = True) -> List[Dict[str, Any]]:
-    """Собирает данные о лайкнутых треках и скачивает их"""
+def fetch_full_tracks(client: 'Client', executor: ThreadPoolExecutor, track_ids: List[Any]):
+    """Получает полную информацию о треках пачками по TRACKS_BATCH_SIZE за запрос.
+    
+    Треки отдаются по мере готовности пачек, чтобы их обработка начиналась,
+    не дожидаясь остальных пачек.
+    """
+    futures = [
+        executor.submit(call_with_backoff, client.tracks, chunk, with_positions=False)
+        for chunk in chunks(track_ids, TRACKS_BATCH_SIZE)
+    ]
+    
+    for future in as_completed(futures):
+        try:
+            yield from future.result()
+        except Exception as e:
+            logger.warning(f"⚠️  Пропуск пачки треков: {e}")
+
+
+def collect_liked_tracks(token: str, output_dir: str, download_audio: bool = True) -> Optional[Dict[str, Any]]:
+    """Собирает данные о лайкнутых треках, скачивает их и возвращает итоговую статистику"""
+    from tqdm import tqdm
+    from tqdm.contrib.logging import logging_redirect_tqdm
+    from yandex_music.exceptions import YandexMusicError
+    
     try:
-        print("🔄 Подключение к Яндекс.Музыке...")
-        client = Client(token).init()
+        logger.info("🔄 Подключение к Яндекс.Музыке...")
+        client = create_client(token)
         
-        print("✅ Успешное подключение!")
-        print("🔄 Получение лайкнутых треков...")
+        logger.info("✅ Успешное подключение!")
+        logger.info("🔄 Получение лайкнутых треков...")
         
         # Получаем лайкнутые треки
         liked_tracks = client.users_likes_tracks()
         if not liked_tracks or not liked_tracks.tracks:
-            print("❌ Не найдено лайкнутых треков")
-            return []
+            logger.error("❌ Не найдено лайкнутых треков")
+            return None
         
         # Создаем структуру папок
         metadata_file, audio_dir = create_output_structure(output_dir)
         
-        tracks_data = []
         total_tracks = len(liked_tracks.tracks)
         downloaded_count = 0
         
-        print(f"📊 Найдено {total_tracks} лайкнутых треков")
+        logger.info(f"📊 Найдено {total_tracks} лайкнутых треков")
         if download_audio:
-            print("🎵 Начинаем скачивание треков...")
+            logger.info("🎵 Начинаем скачивание треков...")
         else:
-            print("🔄 Обработка метаданных...")
+            logger.info("🔄 Обработка метаданных...")
+        
+        metadata = {
+            "generated_at": datetime.datetime.now().isoformat(timespec='seconds'),
+            "source": "Yandex Music API with Local Files"
+        }
+        
+        track_ids = [str(track_short.id) for track_short in liked_tracks.tracks]
+        cache_file = str(Path(output_dir) / CACHE_FILENAME)
         
-        for i, track_short in enumerate(liked_tracks.tracks, 1):
+        # С --verbose вместо индикатора прогресса выводятся сообщения по каждому треку
+        verbose = logger.isEnabledFor(logging.DEBUG)
+        
+        # Треки, уже записанные прошлым (в том числе прерванным) запуском
+        written_tracks = load_written_tracks(metadata_file)
+        
+        # Треки обрабатываются конвейером: пока запрашиваются метаданные следующих пачек,
+        # для уже полученных треков идут запросы ссылок и скачивание, а готовые треки
+        # сразу дописываются в metadata.json
+        with TrackCache(cache_file) as cache, \
+                JsonTracksWriter(metadata_file, metadata) as writer, \
+                ThreadPoolExecutor(max_workers=MAX_API_REQUESTS) as metadata_executor, \
+                ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor, \
+                logging_redirect_tqdm(), \
+                tqdm(total=total_tracks, unit='tr', disable=verbose) as pbar:
+            futures = {}
+            
+            # Треки пишутся в metadata.json в порядке лайков (сначала новые): веб-приложение
+            # раскладывает треки по их позиции в файле. Треки, готовые раньше предыдущих,
+            # ждут в буфере, пока не будут готовы все треки перед ними
+            positions = {track_id: position for position, track_id in enumerate(track_ids)}
+            ready: Dict[int, Optional[Dict[str, Any]]] = {}
+            next_position = 0
+            
+            def emit(track_id: str, track_data: Optional[Dict[str, Any]]) -> None:
+                # track_data=None - трек пропущен, но его место в очереди освобождается
+                nonlocal next_position
+                if track_data is None:
+                    track_data = previous_track_data(track_id)
+                pbar.update(1)
+                position = positions.get(track_id)
+                if position is None:
+                    # API вернул трек под другим id - его место в списке лайков неизвестно
+                    if track_data:
+                        writer.write(track_data)
+                    return
+                ready[position] = track_data
+                while next_position in ready:
+                    track_data = ready.pop(next_position)
+                    if track_data:
+                        writer.write(track_data)
+                    next_position += 1
+            
+            def previous_track_data(track_id: str) -> Optional[Dict[str, Any]]:
+                # Пропущенный в этот раз трек (ошибка API или скачивания) берется из прошлого
+                # запуска, чтобы новый metadata.json не оказался меньше старого
+                track_data = written_tracks.get(track_id)
+                if track_data and download_audio and track_data.get('available') and \
+                        not is_downloaded(audio_dir / f"{track_id}.mp3"):
+                    track_data = {**track_data, "available": False}
+                return track_data
+            
+            def flush_ready() -> None:
+                # Оставшиеся в буфере треки (после пропусков или прерывания) дописываются по порядку
+                for position in sorted(ready):
+                    track_data = ready.pop(position)
+                    if track_data:
+                        writer.write(track_data)
+            
+            def submit(track_data: Dict[str, Any]) -> None:
+                # В пул попадают только треки, которые нужно скачать,
+                # остальные сразу передаются на запись
+                if download_audio and track_data["available"]:
+                    futures[executor.submit(process_track, client, track_data, audio_dir, download_audio)] = track_data
+                else:
+                    emit(track_data["id"], track_data)
+            
             try:
-                # Получаем полную информацию о треке
-                track = client.tracks([track_short.id])[0]
+                missing_ids = []
+                cached_count = 0
+                resumed_count = 0
+                for track_short, track_id in zip(liked_tracks.tracks, track_ids):
+                    # Уже скачанные прошлым запуском треки записываются как есть
+                    written_data = written_tracks.get(track_id)
+                    if download_audio and written_data and written_data.get('available') and \
+                            is_downloaded(audio_dir / f"{track_id}.mp3"):
+                        resumed_count += 1
+                        emit(track_id, written_data)
+                        continue
+                    
+                    # Метаданные, сохраненные при прошлых запусках, берем из кэша
+                    cached_data = cache.get(track_id)
+                    if cached_data:
+                        cached_count += 1
+                        submit(cached_data)
+                        continue
+                    
+                    # Полный трек может прийти прямо в ответе со списком лайков
+                    if track_short.track is not None:
+                        track_data = extract_track_data(track_short.track)
+                        cache.put(track_data)
+                        submit(track_data)
+                    else:
+                        missing_ids.append(track_id)
                 
-                print(f"\n[{i}/{total_tracks}] Обработка: {track.title} - {track.artists[0].name if track.artists else 'Unknown'}")
+                if resumed_count:
+                    logger.info(f"⏭️  Уже скачаны ранее: {resumed_count} треков")
+                if cached_count:
+                    logger.info(f"💾 Метаданные из кэша: {cached_count} треков")
                 
-                track_data = process_track(client, track, audio_dir, download_audio)
-                if track_data:
-                    tracks_data.append(track_data)
-                    if download_audio and track_data.get('available', False):
-                        downloaded_count += 1
+                # Недостающая полная информация запрашивается пачками, а не отдельным запросом на каждый трек
+                fetched_ids = set()
+                for track in fetch_full_tracks(client, metadata_executor, missing_ids):
+                    track_data = extract_track_data(track)
+                    fetched_ids.add(track_data["id"])
+                    cache.put(track_data)
+                    submit(track_data)
                 
-                # Небольшая пауза между запросами
-                time.sleep(0.5)
+                # Треки из пропущенных пачек не должны задерживать запись следующих за ними
+                for track_id in missing_ids:
+                    if track_id not in fetched_ids:
+                        emit(track_id, None)
                 
-            except Exception as e:
-                print(f"⚠️  Пропуск трека {i}: {e}")
-                continue
+                # Прогресс выводится одной строкой вместо сообщения на каждый трек
+                for future in as_completed(futures):
+                    try:
+                        track_data, downloaded = future.result()
+                    except Exception as e:
+                        logger.warning(f"⚠️  Пропуск трека {futures[future]['title']}: {e}")
+                        track_data, downloaded = None, False
+                    
+                    emit(futures[future]["id"], track_data)
+                    if downloaded:
+                        downloaded_count += 1
+                    if track_data:
+                        pbar.set_postfix_str(track_data['title'][:40])
+                        logger.debug(f"Обработан: {track_data['title']} - {track_data['artist']}")
+            except KeyboardInterrupt:
+                # Иначе выход из with дождался бы всех скачиваний, еще стоящих в очереди
+                metadata_executor.shutdown(wait=False, cancel_futures=True)
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+            finally:
+                flush_ready()
         
         # Статистика
-        available_tracks = sum(1 for track in tracks_data if track.get('available', False))
-        
-        print(f"\n✅ Успешно обработано {len(tracks_data)} треков")
+        logger.info(f"\n✅ Успешно обработано {writer.count} треков")
         if download_audio:
-            print(f"🎵 Скачано аудиофайлов: {downloaded_count}")
-            print(f"📁 Доступно для воспроизведения: {available_tracks} треков")
+            logger.info(f"🎵 Скачано аудиофайлов: {downloaded_count}")
+            logger.info(f"📁 Доступно для воспроизведения: {writer.available_count} треков")
         
-        return tracks_data
+        return {
+            "total_tracks": writer.count,
+            "available_tracks": writer.available_count,
+            "genres": writer.genres
+        }
     
     except YandexMusicError as e:
-        print(f"❌ Ошибка Яндекс.Музыки: {e}")
-        print("💡 Проверьте правильность токена")
+        logger.error(f"❌ Ошибка Яндекс.Музыки: {e}")
+        logger.error("💡 Проверьте правильность токена")
         sys.exit(1)
     
     except Exception as e:
-        print(f"❌ Неожиданная ошибка: {e}")
+        logger.error(f"❌ Неожиданная ошибка: {e}")
         sys.exit(1)
 
 
-def save_data_to_json(tracks_data: List[Dict[str, Any]], output_file: str):
-    """Сохраняет данные в JSON файл"""
-    try:
-        # Создаем директорию если не существует
-        os.makedirs(os.path.dirname(output_file), exist_ok=True)
-        
-        # Добавляем метаданные
-        output_data = {
-            "metadata": {
-                "total_tracks": len(tracks_data),
-                "generated_at": __import__('datetime').datetime.now().isoformat(),
-                "source": "Yandex Music API"
-            },
-            "tracks": tracks_data
-        }
-        
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(output_data, f, ensure_ascii=False, indent=2)
-        
-        print(f"✅ Данные сохранены в {output_file}")
-        
-        # Статистика по жанрам
-        genres = {}
-        for track in tracks_data:
-            genre = track.get('genre', 'unknown')
-            genres[genre] = genres.get(genre, 0) + 1
-        
-        print("\n📊 Статистика по жанрам:")
-        for genre, count in sorted(genres.items(), key=lambda x: x[1], reverse=True):
-            print(f"  {genre}: {count} треков")
-    
-    except Exception as e:
-        print(f"❌ Ошибка сохранения: {e}")
-        sys.exit(1)
+def print_genre_stats(genres: Counter) -> None:
+    """Выводит статистику по жанрам, начиная с самых частых"""
+    print("\n📊 Статистика по жанрам:")
+    for genre, count in genres.most_common():
+        print(f"  {genre}: {count} треков")
 
 
 def get_output_directory() -> str:
@@ -444,30 +1030,48 @@ def ask_download_preference() -> bool:
         return False
 
 
+def parse_args() -> argparse.Namespace:
+    """Разбирает аргументы командной строки"""
+    parser = argparse.ArgumentParser(description="Сбор данных из Яндекс.Музыки для Music Galaxy 3D")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="подробный вывод по каждому треку вместо индикатора прогресса")
+    return parser.parse_args()
+
+
 def main():
     """Основная функция"""
+    args = parse_args()
+    # Сообщения выводятся без служебных префиксов, как и остальной вывод скрипта
+    logging.basicConfig(format="%(message)s", stream=sys.stdout)
+    logger.setLevel(logging.DEBUG if args.verbose else logging.INFO)
+    
     print("🎵 Сборщик данных Яндекс.Музыки для Music Galaxy 3D")
     print("=" * 60)
     print("Создает готовую структуру папок для локального использования")
     print("=" * 60)
     
-    # Проверяем установку библиотек
-    try:
-        import yandex_music
+    # Проверяем установку библиотек (без импорта - он нужен только при сборе данных)
+    if find_spec("yandex_music") is not None:
         print("✅ Библиотека yandex-music найдена")
-    except ImportError:
+    else:
         print("❌ Библиотека yandex-music не установлена!")
         print("💡 Установите её командой: pip install yandex-music")
         sys.exit(1)
     
-    try:
-        import requests
+    if find_spec("requests") is not None:
         print("✅ Библиотека requests найдена")
-    except ImportError:
+    else:
         print("❌ Библиотека requests не установлена!")
         print("💡 Установите её командой: pip install requests")
         sys.exit(1)
     
+    if find_spec("tqdm") is not None:
+        print("✅ Библиотека tqdm найдена")
+    else:
+        print("❌ Библиотека tqdm не установлена!")
+        print("💡 Установите её командой: pip install tqdm")
+        sys.exit(1)
+    
     # Получаем настройки от пользователя
     token = get_token_from_user()
     output_dir = get_output_directory()
@@ -475,44 +1079,20 @@ def main():
     
     # Собираем данные и скачиваем треки
     print(f"\n🚀 Начинаем сбор данных...")
-    tracks_data = collect_liked_tracks(token, output_dir, download_audio)
+    summary = collect_liked_tracks(token, output_dir, download_audio)
     
-    if not tracks_data:
+    if not summary or not summary["total_tracks"]:
         print("❌ Не удалось собрать данные о треках")
         sys.exit(1)
     
-    # Сохраняем метаданные в правильном месте
+    # metadata.json записывается по мере обработки треков в collect_liked_tracks
     metadata_file = os.path.join(output_dir, "metadata.json")
     
-    # Создаем структуру данных для metadata.json
-    metadata = {
-        "metadata": {
-            "total_tracks": len(tracks_data),
-            "generated_at": datetime.datetime.now().isoformat(),
-            "source": "Yandex Music API with Local Files"
-        },
-        "tracks": tracks_data
-    }
-    
-    # Сохраняем metadata.json
-    with open(metadata_file, 'w', encoding='utf-8') as f:
-        json.dump(metadata, f, ensure_ascii=False, indent=2)
-    
     print(f"\n✅ Метаданные сохранены: {metadata_file}")
     
-    # Статистика по жанрам
-    genres = {}
-    for track in tracks_data:
-        genre = track.get('genre', 'unknown')
-        genres[genre] = genres.get(genre, 0) + 1
-    
-    print("\n📊 Статистика по жанрам:")
-    for genre, count in sorted(genres.items(), key=lambda x: x[1], reverse=True):
-        print(f"  {genre}: {count} треков")
+    print_genre_stats(summary["genres"])
     
     # Финальная информация
-    available_tracks = sum(1 for track in tracks_data if track.get('available', False))
-    
     print("\n" + "=" * 60)
     print("🎉 ГОТОВО!")
     print("=" * 60)
@@ -520,8 +1100,8 @@ def main():
     print(f"📄 Файл метаданных: metadata.json")
     if download_audio:
         print(f"📁 Папка с аудио: audio/")
-        print(f"🎵 Скачано треков: {available_tracks}")
-    print(f"📊 Всего треков в коллекции: {len(tracks_data)}")
+        print(f"🎵 Скачано треков: {summary['available_tracks']}")
+    print(f"📊 Всего треков в коллекции: {summary['total_tracks']}")
     print("\n💡 Теперь можно использовать эту папку в Music Galaxy 3D!")
     print("   Просто выберите её в веб-приложении.")
 